@@ -3,7 +3,9 @@ import logging
 import os
 
 from logging.handlers import RotatingFileHandler
+from utils.archive import ResponseArchive
 from utils.data_scrapper import OtodomScraper
+from utils.scheduler import ScrapeScheduler
 from utils.visualize_data import Visualization
 from utils.save_to_csv import save_to_csv
 from time import gmtime, strftime
@@ -40,20 +42,32 @@ def main():
     
     parser = argparse.ArgumentParser(description="Run the Otodom data scraper and analysis tool.")
     parser.add_argument('--scrape', action='store_true', help="Run the web scraper to collect data from Otodom.")
-    parser.add_argument('city', type=str, help="City name to scrape data for.")
+    parser.add_argument('city', type=str, nargs='?', help="City name to scrape data for.")
     parser.add_argument('--minarea', type=int, default=0, help="Minimum area in meters for filtering properties.")
     parser.add_argument('--maxarea', type=int, default=1000, help="Maximum area in meters for filtering properties.")
     parser.add_argument('--visualize', action='store_true', help="Visualize the data collected from Otodom.")
     parser.add_argument('--save', action='store_true', help="Save the data to a CSV file.")
     parser.add_argument('--darkmode', action='store_true', help="Use dark mode for visualizations.")
+    parser.add_argument('--daemon', type=str, metavar='CONFIG', help="Run scheduled scrapes for the cities listed in a JSON config file.")
+    parser.add_argument('--archive', action='store_true', help="Keep compressed raw HTML of fetched pages and send conditional requests.")
+    parser.add_argument('--reparse', action='store_true', help="Rebuild flats data from the archived HTML without network access.")
+    parser.add_argument('--archive-date', type=str, default=None, help="Day (Y-m-d) of archived pages used by --reparse, newest by default.")
     args = parser.parse_args()
+    if args.city is None and not args.daemon:
+        parser.error("the city argument is required unless --daemon is used")
     # Setup logger
-    logger = setup_logger(city=args.city)
+    logger = setup_logger(city=args.city or "Daemon")
     logger.info(f"Starting application with arguments: {vars(args)}")
+
+    if args.daemon:
+        logger.info(f"Starting scheduler daemon with config: {args.daemon}")
+        ScrapeScheduler(args.daemon, setup_logger=setup_logger).run()
+        return
     
     if args.scrape:
         logger.info(f"Starting scraping for city: {args.city}")
-        scraper = OtodomScraper(min_area=args.minarea, max_area=args.maxarea, setup_logger=setup_logger, city=args.city)
+        archive = ResponseArchive() if args.archive else None
+        scraper = OtodomScraper(min_area=args.minarea, max_area=args.maxarea, setup_logger=setup_logger, city=args.city, archive=archive)
         data = scraper.parse_data()
         if data:
             logger.info(f"Scraping completed successfully. Total flats found: {data}")
@@ -61,15 +75,25 @@ def main():
         else:
             logger.error("Scraping failed")    
     
+    if args.reparse:
+        logger.info(f"Starting reparse of archived pages for city: {args.city}")
+        scraper = OtodomScraper(min_area=args.minarea, max_area=args.maxarea, setup_logger=setup_logger, city=args.city,
+                                archive=ResponseArchive(), offline=True)
+        data = scraper.reparse_archive(fetch_date=args.archive_date)
+        if data:
+            logger.info(f"Reparse completed successfully. Total flats parsed: {data}")
+        else:
+            logger.error("Reparse failed")
+
     if args.visualize:
         logger.info("Starting data visualization")
-        visualizer = Visualization(dark_mode=args.darkmode, min_area=args.minarea, max_area=args.maxarea)
+        visualizer = Visualization(dark_mode=args.darkmode, min_area=args.minarea, max_area=args.maxarea, city=args.city)
         visualizer.visualize()
         logger.info("Visualization completed")
     
     if args.save:
         logger.info("Starting data save to CSV")
-        save_to_csv()
+        save_to_csv(city=args.city)
         logger.info("Data save completed")
 
 if __name__ == "__main__":
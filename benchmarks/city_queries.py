@@ -0,0 +1,122 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+
+from utils.city_stats import create_stats_schema, get_city_stats
+from utils.db import DB_CONFIG
+from utils.listing_history import create_history_schema
+
+COUNT_QUERY = '''
+    SELECT COUNT(*)
+    FROM flats f
+    JOIN scrapes s ON f.scrape_id = s.id
+    WHERE s.city_id = %s
+'''
+DATE_RANGE_QUERY = '''
+    SELECT COUNT(*), AVG(f.price_per_meter)
+    FROM flats f
+    JOIN scrapes s ON f.scrape_id = s.id
+    WHERE s.city_id = %s AND s.scrape_date >= %s
+'''
+
+def create_dataset(cursor, rows: int, cities: int, days: int) -> None:
+    cursor.execute('CREATE TABLE cities (id SERIAL PRIMARY KEY, name VARCHAR(100) UNIQUE)')
+    cursor.execute('''
+        CREATE TABLE scrapes (
+            id SERIAL PRIMARY KEY,
+            city_id INTEGER REFERENCES cities(id),
+            scrape_date TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE flats (
+            id SERIAL PRIMARY KEY,
+            scrape_id INTEGER REFERENCES scrapes(id) ON DELETE CASCADE,
+            title TEXT, address TEXT, link TEXT, rooms TEXT,
+            surface FLOAT, price_per_meter FLOAT, total_price INTEGER, rent_price INTEGER
+        )
+    ''')
+    cursor.execute("INSERT INTO cities (name) SELECT 'city_' || i FROM generate_series(1, %s) i", (cities,))
+    cursor.execute('''
+        INSERT INTO scrapes (city_id, scrape_date)
+        SELECT c, to_char(DATE '2024-01-01' + d, 'YYYY-MM-DD')
+        FROM generate_series(1, %s) c, generate_series(0, %s - 1) d
+    ''', (cities, days))
+    cursor.execute('''
+        INSERT INTO flats (scrape_id, title, address, link, rooms, surface, price_per_meter, total_price, rent_price)
+        SELECT 1 + (random() * (%s - 1))::int, 'Mieszkanie ' || i, 'ul. Przykladowa, Dzielnica, Miasto, woj',
+               'https://www.otodom.pl/pl/oferta/' || i, '3', 30 + random() * 70,
+               8000 + random() * 8000, (300000 + random() * 700000)::int, (300 + random() * 900)::int
+        FROM generate_series(1, %s) i
+    ''', (cities * days, rows))
+    cursor.execute('CREATE UNIQUE INDEX idx_flats_link ON flats(link)')
+    cursor.execute('ANALYZE')
+
+def measure(cursor, query: str, params: tuple, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        cursor.execute(query, params)
+        cursor.fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark city-level queries on a synthetic dataset.")
+    parser.add_argument('--rows', type=int, default=3_000_000, help="Number of synthetic flats.")
+    parser.add_argument('--cities', type=int, default=20, help="Number of synthetic cities.")
+    parser.add_argument('--days', type=int, default=365, help="Number of daily scrapes per city.")
+    parser.add_argument('--repeats', type=int, default=5, help="Runs per query, the median is reported.")
+    parser.add_argument('--host', type=str, default=DB_CONFIG["host"], help="Database host or socket directory.")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**{**DB_CONFIG, "host": args.host})
+    cursor = conn.cursor()
+    # Everything lives in a throwaway schema next to the real tables
+    cursor.execute('DROP SCHEMA IF EXISTS bench_city_queries CASCADE')
+    cursor.execute('CREATE SCHEMA bench_city_queries')
+    cursor.execute('SET search_path TO bench_city_queries')
+    try:
+        started = time.perf_counter()
+        create_dataset(cursor, args.rows, args.cities, args.days)
+        conn.commit()
+        print(f"Created {args.rows} flats in {args.cities * args.days} scrapes in {time.perf_counter() - started:.1f}s")
+
+        date_from = '2024-12-01'
+        before_count = measure(cursor, COUNT_QUERY, (1,), args.repeats)
+        before_range = measure(cursor, DATE_RANGE_QUERY, (1, date_from), args.repeats)
+
+        started = time.perf_counter()
+        create_history_schema(cursor)
+        create_stats_schema(cursor)
+        cursor.execute('ANALYZE')
+        conn.commit()
+        print(f"Migration (indexes + summary backfill) took {time.perf_counter() - started:.1f}s")
+
+        after_count = measure(cursor, COUNT_QUERY, (1,), args.repeats)
+        after_range = measure(cursor, DATE_RANGE_QUERY, (1, date_from), args.repeats)
+        timings = []
+        for _ in range(args.repeats):
+            started = time.perf_counter()
+            get_city_stats(cursor, 'city_1')
+            timings.append((time.perf_counter() - started) * 1000)
+        stats_lookup = statistics.median(timings)
+
+        print(f"{'query':<40}{'no indexes':>14}{'indexes':>14}")
+        print(f"{'COUNT(*) flats of a city':<40}{before_count:>11.1f} ms{after_count:>11.1f} ms")
+        print(f"{'last month of a city (count, avg)':<40}{before_range:>11.1f} ms{after_range:>11.1f} ms")
+        print(f"{'city_stats lookup':<40}{'':>14}{stats_lookup:>11.2f} ms")
+    finally:
+        conn.rollback()
+        cursor.execute('DROP SCHEMA IF EXISTS bench_city_queries CASCADE')
+        conn.commit()
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import os
+import pickle
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.listing import Listing
+
+LISTINGS = 100_000
+
+def make_values(i: int):
+    return (
+        f"Mieszkanie {i % 4 + 1}-pokojowe, {40 + i % 60} m2",
+        f"ul. Przykladowa {i % 300}, Dzielnica {i % 25}, Gdansk, pomorskie",
+        f"https://www.otodom.pl/pl/oferta/mieszkanie-ID{i:08d}",
+        f"{i % 4 + 1}",
+        40.0 + i % 60 + 0.5,
+        9000.0 + i % 5000,
+        400_000 + i * 7,
+        400 + i % 800
+    )
+
+def build_dicts():
+    keys = ('title', 'address', 'link', 'rooms', 'surface', 'price_per_meter', 'total_price', 'rent_price')
+    return [dict(zip(keys, make_values(i))) for i in range(LISTINGS)]
+
+def build_listings():
+    return [Listing(*make_values(i)) for i in range(LISTINGS)]
+
+def measure(builder):
+    tracemalloc.start()
+    data = builder()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return data, size
+
+def main():
+    # Field values (strings, numbers) are allocated in both cases, so the difference is the per-record container
+    dicts, dict_bytes = measure(build_dicts)
+    listings, listing_bytes = measure(build_listings)
+    print(f"{LISTINGS} synthetic listings")
+    print(f"dict:    {dict_bytes / LISTINGS:8.1f} bytes/listing")
+    print(f"Listing: {listing_bytes / LISTINGS:8.1f} bytes/listing")
+    print(f"pickled dict list:    {len(pickle.dumps(dicts)) / LISTINGS:8.1f} bytes/listing")
+    print(f"pickled Listing list: {len(pickle.dumps(listings)) / LISTINGS:8.1f} bytes/listing")
+
+if __name__ == "__main__":
+    main()
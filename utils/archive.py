@@ -0,0 +1,127 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import zstandard
+
+from typing import List, Optional, Tuple
+
+def city_key(city: str) -> str:
+    '''
+    Normalise a city name used as archive key.
+    Example: 'zielona gora' -> 'zielona_gora'
+    '''
+    return re.sub(r'\W+', '_', city.lower())
+
+class ResponseArchive:
+    '''
+    Archive of raw listing and detail page HTML, compressed with zstd and keyed by URL and fetch date.
+    The ETag and Last-Modified headers are kept so later fetches can be sent as conditional requests.
+    A row without body means the server answered 304 and the previous body is still current.
+    '''
+    def __init__(self, path: str = os.path.join("archive", "responses.db"), level: int = 10):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.level = level
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT,
+                fetch_date TEXT,
+                kind TEXT,
+                city TEXT,
+                page INTEGER,
+                etag TEXT,
+                last_modified TEXT,
+                body BLOB,
+                PRIMARY KEY (url, fetch_date)
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_city ON responses(city, kind, fetch_date)')
+        self.conn.commit()
+
+    def store(self, url: str, body: Optional[str], kind: str, city: Optional[str] = None, page: Optional[int] = None,
+              etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        '''
+        Save a fetched response for today. Pass body=None for a 304 Not Modified answer.
+        --------------------------------
+        Args:
+            url: Full request URL including query parameters.
+            body: HTML of the page or None if unchanged.
+            kind: 'listing' for search result pages, 'detail' for single listings.
+            city: City of a listing page.
+            page: Number of a listing page.
+            etag: ETag response header.
+            last_modified: Last-Modified response header.
+        '''
+        blob = zstandard.ZstdCompressor(level=self.level).compress(body.encode('utf-8')) if body is not None else None
+        # A 304 must not hide a body that was already stored today
+        conflict = 'REPLACE' if blob is not None else 'IGNORE'
+        with self.lock:
+            self.conn.execute(f'''
+                INSERT OR {conflict} INTO responses (url, fetch_date, kind, city, page, etag, last_modified, body)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (url, time.strftime('%Y-%m-%d'), kind, city_key(city) if city else None, page, etag, last_modified, blob))
+            self.conn.commit()
+
+    def validators(self, url: str) -> Optional[Tuple[Optional[str], Optional[str]]]:
+        '''
+        Return ETag and Last-Modified of the newest stored body of a URL without decompressing it.
+        '''
+        with self.lock:
+            return self.conn.execute('''
+                SELECT etag, last_modified FROM responses
+                WHERE url = ? AND body IS NOT NULL
+                ORDER BY fetch_date DESC LIMIT 1
+            ''', (url,)).fetchone()
+
+    def latest(self, url: str, until: Optional[str] = None) -> Optional[Tuple[str, Optional[str], Optional[str]]]:
+        '''
+        Return the newest archived body of a URL.
+        --------------------------------
+        Args:
+            url: Full request URL including query parameters.
+            until: Only consider bodies fetched on or before this day (Y-m-d).
+        Returns:
+            tuple: Body, ETag and Last-Modified of the newest stored response.
+            None: If the URL was never archived.
+        '''
+        with self.lock:
+            row = self.conn.execute('''
+                SELECT body, etag, last_modified FROM responses
+                WHERE url = ? AND body IS NOT NULL AND fetch_date <= ?
+                ORDER BY fetch_date DESC LIMIT 1
+            ''', (url, until or '9999-12-31')).fetchone()
+        if row is None:
+            return None
+        return zstandard.ZstdDecompressor().decompress(row[0]).decode('utf-8'), row[1], row[2]
+
+    def listing_pages(self, city: str, fetch_date: Optional[str] = None) -> List[Tuple[int, str, str]]:
+        '''
+        Return listing pages of a city fetched on one day.
+        --------------------------------
+        Args:
+            city: City name.
+            fetch_date: Day in format Y-m-d, the newest archived day when not given.
+        Returns:
+            list: Tuples of page number, URL and fetch date ordered by page.
+        '''
+        with self.lock:
+            if fetch_date is None:
+                row = self.conn.execute('''
+                    SELECT MAX(fetch_date) FROM responses WHERE city = ? AND kind = 'listing'
+                ''', (city_key(city),)).fetchone()
+                fetch_date = row[0]
+            return self.conn.execute('''
+                SELECT page, url, fetch_date FROM responses
+                WHERE city = ? AND kind = 'listing' AND fetch_date = ?
+                ORDER BY page
+            ''', (city_key(city), fetch_date)).fetchall()
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
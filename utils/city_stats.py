@@ -0,0 +1,176 @@
+from typing import Dict, Optional, Union
+from utils.listing import Number
+
+STAT_COLUMNS = ('total_price', 'price_per_meter', 'surface')
+STATS_INDEXES = {
+    'idx_flats_scrape_id': 'flats(scrape_id)',
+    'idx_scrapes_city_id_date': 'scrapes(city_id, scrape_date)',
+    'idx_scrapes_scrape_date': 'scrapes(scrape_date)',
+    'idx_flat_versions_scrape_id': 'flat_versions(scrape_id)',
+}
+
+def create_stats_schema(cursor) -> None:
+    '''
+    Add indexes for city-level queries and the summary tables maintained by the bulk insert.
+    When the summary tables are created for the first time they are filled from the existing flats.
+    --------------------------------
+    Args:
+        cursor: Open psycopg2 cursor.
+    '''
+    # CREATE INDEX IF NOT EXISTS still takes a SHARE lock that waits for running inserts
+    for name, definition in STATS_INDEXES.items():
+        cursor.execute('SELECT to_regclass(%s) IS NULL', (name,))
+        if cursor.fetchone()[0]:
+            cursor.execute(f'CREATE INDEX {name} ON {definition}')
+
+    cursor.execute("SELECT to_regclass('city_stats') IS NULL")
+    backfill = cursor.fetchone()[0]
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS city_stats (
+            city_id INTEGER PRIMARY KEY,
+            total_flats BIGINT NOT NULL DEFAULT 0,
+            total_price_count BIGINT NOT NULL DEFAULT 0,
+            total_price_sum NUMERIC NOT NULL DEFAULT 0,
+            price_per_meter_count BIGINT NOT NULL DEFAULT 0,
+            price_per_meter_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+            surface_count BIGINT NOT NULL DEFAULT 0,
+            surface_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+            last_scrape_id INTEGER,
+            FOREIGN KEY (city_id) REFERENCES cities(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scrape_stats (
+            scrape_id INTEGER PRIMARY KEY,
+            city_id INTEGER,
+            scraped_flats INTEGER NOT NULL DEFAULT 0,
+            new_flats INTEGER NOT NULL DEFAULT 0,
+            changed_flats INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (scrape_id) REFERENCES scrapes(id) ON DELETE CASCADE
+        )
+    ''')
+    if backfill:
+        rebuild_city_stats(cursor)
+
+def rebuild_city_stats(cursor) -> None:
+    '''
+    Recompute city_stats from the flats table.
+    Needed after flats were deleted outside of the scraper, e.g. by removing a scrape.
+    --------------------------------
+    Args:
+        cursor: Open psycopg2 cursor.
+    '''
+    cursor.execute('DELETE FROM city_stats')
+    cursor.execute('''
+        INSERT INTO city_stats (city_id, total_flats,
+                                total_price_count, total_price_sum,
+                                price_per_meter_count, price_per_meter_sum,
+                                surface_count, surface_sum, last_scrape_id)
+        SELECT s.city_id, COUNT(*),
+               COUNT(f.total_price), COALESCE(SUM(f.total_price), 0),
+               COUNT(f.price_per_meter), COALESCE(SUM(f.price_per_meter), 0),
+               COUNT(f.surface), COALESCE(SUM(f.surface), 0),
+               (SELECT id FROM scrapes WHERE city_id = s.city_id ORDER BY scrape_date DESC, id DESC LIMIT 1)
+        FROM flats f
+        JOIN scrapes s ON f.scrape_id = s.id
+        GROUP BY s.city_id
+    ''')
+
+def empty_delta() -> Dict[str, Union[int, float]]:
+    '''
+    Counters of one scrape that are added to city_stats by `apply_delta`.
+    '''
+    delta = {'total_flats': 0}
+    for column in STAT_COLUMNS:
+        delta[column + '_count'] = 0
+        delta[column + '_sum'] = 0
+    return delta
+
+def add_to_delta(delta: Dict[str, Union[int, float]], column: str, value: Number, sign: int = 1) -> None:
+    '''
+    Add (sign=1) or remove (sign=-1) a single value of a listing from the delta.
+    '''
+    if value is None:
+        return
+    delta[column + '_count'] += sign
+    delta[column + '_sum'] += sign * value
+
+def apply_delta(cursor, city_id: int, scrape_id: int, scraped: int, new: int, changed: int,
+                deltas: Dict[int, Dict[str, Union[int, float]]], latest: bool = True) -> None:
+    '''
+    Record the summary of a scrape and add its counters to city_stats.
+    Storing the same scrape again (a repeated reparse) adds to its summary.
+    --------------------------------
+    Args:
+        cursor: Open psycopg2 cursor.
+        city_id: Id of the scraped city.
+        scrape_id: Id of the current scrape.
+        scraped: Number of scraped listings.
+        new: Number of new listings.
+        changed: Number of changed listings.
+        deltas: Counters built with `add_to_delta`, per city id. Only the scraped
+            city gets its last_scrape_id moved.
+        latest: False for a scrape older than the newest one, last_scrape_id is then kept.
+    '''
+    cursor.execute('''
+        INSERT INTO scrape_stats (scrape_id, city_id, scraped_flats, new_flats, changed_flats)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (scrape_id) DO UPDATE SET
+            scraped_flats = EXCLUDED.scraped_flats,
+            new_flats = scrape_stats.new_flats + EXCLUDED.new_flats,
+            changed_flats = scrape_stats.changed_flats + EXCLUDED.changed_flats
+    ''', (scrape_id, city_id, scraped, new, changed))
+    # Sorted so that concurrent scrapes lock city_stats rows in the same order
+    for delta_city_id in sorted(deltas):
+        delta = deltas[delta_city_id]
+        columns = list(delta)
+        cursor.execute(f'''
+            INSERT INTO city_stats (city_id, last_scrape_id, {', '.join(columns)})
+            VALUES (%s, %s, {', '.join(['%s'] * len(columns))})
+            ON CONFLICT (city_id) DO UPDATE SET
+                last_scrape_id = COALESCE(EXCLUDED.last_scrape_id, city_stats.last_scrape_id),
+                {', '.join(f'{column} = city_stats.{column} + EXCLUDED.{column}' for column in columns)}
+        ''', [delta_city_id, scrape_id if latest and delta_city_id == city_id else None] + [delta[column] for column in columns])
+
+def get_city_stats(cursor, city_name: str) -> Optional[Dict[str, Union[int, float, None]]]:
+    '''
+    Read the maintained counters of a city with a single primary key lookup.
+    Falls back to aggregating flats while the database has not been migrated yet.
+    --------------------------------
+    Args:
+        cursor: Open psycopg2 cursor.
+        city_name: Name of the city as stored in the cities table.
+    Returns:
+        dict: Number of flats, average prices and surface, last scrape id.
+        None: If the city has no stats yet.
+    '''
+    cursor.execute("SELECT to_regclass('city_stats') IS NULL")
+    if cursor.fetchone()[0]:
+        cursor.execute('''
+            SELECT COUNT(*), AVG(f.total_price), AVG(f.price_per_meter), AVG(f.surface), MAX(s.id)
+            FROM flats f
+            JOIN scrapes s ON f.scrape_id = s.id
+            JOIN cities c ON s.city_id = c.id
+            WHERE c.name = %s
+        ''', (city_name,))
+    else:
+        cursor.execute('''
+            SELECT cs.total_flats,
+                   cs.total_price_sum / NULLIF(cs.total_price_count, 0),
+                   cs.price_per_meter_sum / NULLIF(cs.price_per_meter_count, 0),
+                   cs.surface_sum / NULLIF(cs.surface_count, 0),
+                   cs.last_scrape_id
+            FROM city_stats cs
+            JOIN cities c ON cs.city_id = c.id
+            WHERE c.name = %s
+        ''', (city_name,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    return {
+        'total_flats': row[0],
+        'avg_total_price': float(row[1]) if row[1] is not None else None,
+        'avg_price_per_meter': row[2],
+        'avg_surface': row[3],
+        'last_scrape_id': row[4]
+    }
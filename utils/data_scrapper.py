@@ -6,10 +6,18 @@ import concurrent.futures
 import time
 
 from bs4 import BeautifulSoup
+from psycopg2 import pool
 from geopy.geocoders import Nominatim
 from logging.handlers import RotatingFileHandler
 from math import ceil
 from unidecode import unidecode
+from utils.archive import ResponseArchive
+from utils.city_stats import apply_delta, create_stats_schema, get_city_stats
+from utils.db import connect
+from utils.listing import Listing
+from utils.listing_history import create_history_schema, store_changes
+from utils.normalize import normalize_listings
+from urllib.parse import parse_qs, urlparse
 from typing import Optional, List, Dict, Union, Tuple
 
 class OtodomScraper:
@@ -17,10 +25,27 @@ class OtodomScraper:
                  min_area, 
                  max_area, 
                  setup_logger: Optional[logging.Logger] = None,
-                 city: Optional[str] = None):
+                 city: Optional[str] = None,
+                 session: Optional[requests.Session] = None,
+                 db_pool: Optional[pool.ThreadedConnectionPool] = None,
+                 geocode_cache: Optional[Dict[str, Tuple[str, str, str]]] = None,
+                 rent_cache: Optional[Dict[str, Tuple[float, str]]] = None,
+                 archive: Optional[ResponseArchive] = None,
+                 offline: bool = False):
         self.logger = setup_logger(name=__name__, city=city+" Scraper")
         self.user_input = input("Write the city name: ") if city is None else city
-        self.city_name, self.city_district, self.vojevodian = self.__get_place_details(self.user_input)
+        # Shared between runs in daemon mode, private to this scraper otherwise
+        self.db_pool = db_pool
+        self.geocode_cache = geocode_cache if geocode_cache is not None else {}
+        self.rent_cache = rent_cache if rent_cache is not None else {}
+        # Offline mode reads every page from the archive and never touches the network
+        self.archive = archive
+        self.offline = offline
+        self.archive_date = None
+        if self.offline:
+            self.city_name, self.city_district, self.vojevodian = self.user_input.lower(), self.user_input.lower(), "unknown"
+        else:
+            self.city_name, self.city_district, self.vojevodian = self.__get_place_details(self.user_input)
         self.city_name = self.__convert_to_ascii(self.city_name)
         self.city_district = self.__convert_to_ascii(self.city_district)
         self.vojevodian = self.__convert_to_ascii(self.vojevodian)
@@ -46,25 +71,23 @@ class OtodomScraper:
             "Connection": "keep-alive",
             "Upgrade-Insecure-Requests": "1"
         }
+        self.session = session if session is not None else requests.Session()
             
-    def __clean_numeric_data(self, string: str) -> Union[float,int,None]:
+    def __get_connection(self):
         '''
-        Function clean numeric data from the preffix and suffix.
-        --------------------------------
-        Args:
-            string (str): The string to clean.
-        Example:
-            Input: 23 000zł
-            Output: 23000
-        Returns:
-            Float | Int | None
+        Take a connection from the shared pool if there is one, otherwise open a new one.
         '''
-        string = string.replace(',', '.')
-        string = string.split("zł")[0]
-        digit_str = re.sub(r'[^\d+.]', '', string)
-        if digit_str:
-            return float(digit_str) if '.' in digit_str else int(digit_str)
-        
+        return self.db_pool.getconn() if self.db_pool else connect()
+
+    def __release_connection(self, conn) -> None:
+        '''
+        Return a connection taken with `__get_connection`.
+        '''
+        if self.db_pool:
+            self.db_pool.putconn(conn)
+        else:
+            conn.close()
+
     def __convert_to_ascii(self, text: str) -> str:
         '''
         Convert Polish characters to their ASCII equivalents.
@@ -86,12 +109,7 @@ class OtodomScraper:
         conn = None
         try:
             self.city_name = re.sub(r'\W+', '_', self.city_name)
-            conn = psycopg2.connect(
-                dbname="otodom_db",
-                user="scraper_user",
-                password="1234",
-                host="localhost"
-            )
+            conn = self.__get_connection()
             cursor = conn.cursor()
             
             self.logger.info(f"Creating table for city: {self.city_name}")
@@ -127,6 +145,8 @@ class OtodomScraper:
                 )
             ''')
             cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_flats_link ON flats(link)')
+            create_history_schema(cursor)
+            create_stats_schema(cursor)
             conn.commit()
             self.logger.info(f"Table '{self.city_name}' created or already exists.")
 
@@ -136,25 +156,24 @@ class OtodomScraper:
             self.logger.exception(f"Unexpected error when creating table '{self.city_name}': {e}")
         finally:
             if conn:
-                conn.close()
+                self.__release_connection(conn)
                 self.logger.info("Database connection closed.")
 
-    def __insert_data(self, data: List[Dict[str, Union[str, int, float]]]) -> None:
+    def __insert_data(self, data: List[Listing], scrape_date: Optional[str] = None) -> None:
         '''
         Insert data into the database using relational structure.
+        A reparse reuses the scrape of its day if there is one. When that day is older than
+        the newest scrape of the city, current flats and city_stats sums are left untouched:
+        only missing flats are inserted and differing ones get a history row.
         --------------------------------
         Args:
-            data: List of dictionaries with flat data.
+            data: List of scraped listings.
+            scrape_date: Date of a reparsed scrape (Y-m-d), today when not given.
         '''
         conn = None
         try:
             self.logger.info("Inserting data into the database (relational structure).")
-            conn = psycopg2.connect(
-                dbname="otodom_db",
-                user="scraper_user",
-                password="1234",
-                host="localhost"
-            )
+            conn = self.__get_connection()
             cursor = conn.cursor()
 
             # Wstawienie miasta, jeśli nie istnieje
@@ -163,35 +182,34 @@ class OtodomScraper:
             city_id = cursor.fetchone()[0]
 
             # Wstawienie rekordu scrapowania
-            scrape_date = time.strftime('%Y-%m-%d')
-            cursor.execute('INSERT INTO scrapes (city_id, scrape_date) VALUES (%s, %s) RETURNING id', (city_id, scrape_date))
-            scrape_id = cursor.fetchone()[0]
-
-            # Wstawienie mieszkań
-            for flat in data:
-                cursor.execute('''
-                    INSERT INTO flats (scrape_id, title, address, link, rooms, surface, price_per_meter, total_price, rent_price)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (link) DO NOTHING
-                ''', (
-                    scrape_id,
-                    flat.get('title', ''),
-                    flat.get('address', ''),
-                    flat.get('link', ''),
-                    flat.get('rooms', ''),
-                    flat.get('surface', 0),
-                    flat.get('price_per_meter', 0),
-                    flat.get('total_price', 0),
-                    flat.get('rent_price', 0)
-                ))
+            scrape_id = None
+            latest = True
+            if scrape_date:
+                cursor.execute('SELECT MAX(scrape_date) FROM scrapes WHERE city_id = %s', (city_id,))
+                newest_date = cursor.fetchone()[0]
+                latest = newest_date is None or scrape_date >= newest_date
+                cursor.execute('SELECT MAX(id) FROM scrapes WHERE city_id = %s AND scrape_date = %s', (city_id, scrape_date))
+                scrape_id = cursor.fetchone()[0]
+            scrape_date = scrape_date or time.strftime('%Y-%m-%d')
+            if scrape_id is None:
+                cursor.execute('INSERT INTO scrapes (city_id, scrape_date) VALUES (%s, %s) RETURNING id', (city_id, scrape_date))
+                scrape_id = cursor.fetchone()[0]
+
+            # Wstawienie tylko nowych i zmienionych mieszkań
+            new_flats, changed_flats, deltas = store_changes(cursor, city_id, scrape_id, data, update_current=latest)
+            apply_delta(cursor, city_id, scrape_id, len(data), new_flats, changed_flats, deltas, latest=latest)
             conn.commit()
-            self.logger.info(f"Inserted {len(data)} flats for city '{self.city_name}' and date {scrape_date}.")
+            self.logger.info(f"Stored {new_flats} new and {changed_flats} {'changed' if latest else 'historical'} flats "
+                             f"out of {len(data)} scraped for city '{self.city_name}' and date {scrape_date}.")
+            flagged = sum(1 for flat in data if flat.invalid_fields)
+            if flagged:
+                self.logger.warning(f"{flagged} flats have fields that could not be parsed, see flats.invalid_fields.")
         except psycopg2.Error as e:
             self.logger.error(f"Database error when inserting scrape data: {e}")
         finally:
             if conn:
                 self.logger.info("Database connection closed.")
-                conn.close()
+                self.__release_connection(conn)
     
     def __get_place_details(self, city: str) -> Tuple[str, str, str]:
         '''
@@ -206,6 +224,8 @@ class OtodomScraper:
         Returns:
             tuple: A tuple containing the city name, city district name and vojevodian name.
         '''
+        if city in self.geocode_cache:
+            return self.geocode_cache[city]
         raw_address = Nominatim(user_agent="otodom_scraper").geocode(city, language="pl", country_codes="pl", addressdetails=True).address # type: ignore
         if raw_address is None:
             self.logger.error(f"Could not find location for city: {city}")
@@ -213,37 +233,91 @@ class OtodomScraper:
         self.logger.info(f"Found location for city: {city} - {raw_address}")
         address = raw_address.split(',')
         if len(address) < 4:
-            return address[0].lower(), address[0].lower(), address[1].split()[1].lower()
+            details = address[0].lower(), address[0].lower(), address[1].split()[1].lower()
+        else:
+            details = address[0].lower(), address[1].split()[1].lower(), address[2].split()[1].lower()
+        self.geocode_cache[city] = details
+        return details
+
+    def __request(self, url: str, params: Optional[Dict] = None) -> requests.Response:
+        '''
+        Send a GET request, made conditional with the validators of the archived copy if there is one.
+        '''
+        headers = self.headers
+        if self.archive:
+            validators = self.archive.validators(requests.Request('GET', url, params=params).prepare().url)
+            if validators:
+                etag, last_modified = validators
+                headers = dict(self.headers)
+                if etag:
+                    headers["If-None-Match"] = etag
+                if last_modified:
+                    headers["If-Modified-Since"] = last_modified
+        return self.session.get(url, params=params, headers=headers)
+
+    def __archive_response(self, response: requests.Response, listing: bool) -> Optional[str]:
+        '''
+        Store a 200 response in the archive or resolve a 304 response to the archived body.
+        '''
+        if not self.archive:
+            return response.text
+        request_url = response.history[0].request.url if response.history else response.request.url
+        page = parse_qs(urlparse(request_url).query).get("page")
+        if response.status_code == 304:
+            archived = self.archive.latest(request_url)
+            body = archived[0] if archived else None
         else:
-            return address[0].lower(), address[1].split()[1].lower(), address[2].split()[1].lower()
+            body = response.text
+        self.archive.store(request_url,
+                           None if response.status_code == 304 else body,
+                           kind="listing" if listing else "detail",
+                           city=self.city_name if listing else None,
+                           page=int(page[0]) if listing and page else None,
+                           etag=response.headers.get("ETag"),
+                           last_modified=response.headers.get("Last-Modified"))
+        return body
+
+    def __archived_content(self, url: Optional[str]) -> Optional[str]:
+        '''
+        Read a page from the archive instead of the network.
+        '''
+        full_url = requests.Request('GET', url or self.base_url, params=None if url else self.params).prepare().url
+        archived = self.archive.latest(full_url, until=self.archive_date) if self.archive else None
+        if archived is None:
+            self.logger.error(f"Page not found in archive: {full_url}")
+            return None
+        return archived[0]
 
     def get_pageContent(self, url: Optional[str] = None) -> Union[str, None]:
         """
         This function is used to get the HTML content of the page.
+        With an archive, unchanged pages are answered with 304 and read from the archive.
         --------------------------------
         Args:
             url: The URL to fetch. If not provided, uses the base URL with parameters.
         Returns:
             str: The HTML content of the page.
         """
+        if self.offline:
+            return self.__archived_content(url)
         try:
             if url is not None:
-                response = requests.get(url, headers=self.headers)
+                response = self.__request(url)
             else:
-                response = requests.get(self.base_url, params=self.params, headers=self.headers)
+                response = self.__request(self.base_url, params=self.params)
             self.logger.info(f"Requesting URL: {response.url}")
             
-            if response.status_code == 200:
-                return response.text
+            if response.status_code in (200, 304):
+                return self.__archive_response(response, listing=url is None)
             elif response.status_code == 404:
                 if url is not None:
-                    response = requests.get(url, headers=self.headers)
+                    response = self.__request(url)
                 else:
                     self.base_url = "https://www.otodom.pl/pl/wyniki/sprzedaz/mieszkanie/" + self.vojevodian + "/" + self.city_district + "/" + f"gmina-miejska--{self.city_name}" + "/" + self.city_name
-                    response = requests.get(self.base_url, params=self.params, headers=self.headers)
+                    response = self.__request(self.base_url, params=self.params)
                     self.logger.info(f"Requesting URL: {response.url}")
-                    if response.status_code == 200:
-                        return response.text
+                    if response.status_code in (200, 304):
+                        return self.__archive_response(response, listing=True)
             elif response.status_code == 403:
                 self.logger.error("Access forbidden (403). Check your headers or IP restrictions. Waiting 5 minutes before retrying...")
                 time.sleep(300)
@@ -266,6 +340,8 @@ class OtodomScraper:
         '''
         self.totalitems = 0
         all_data = []
+        self.page = 1
+        self.params["page"] = self.page
 
         html_content = self.get_pageContent()
         if not html_content:
@@ -277,30 +353,16 @@ class OtodomScraper:
             self.logger.error("Failed to determine total page count")
             return None
 
-        def process_page(page: int) -> List[Dict]:
+        def process_page(page: int) -> List[Listing]:
             """Process a single page and return extracted data"""
-            page_data = []
             self.logger.info(f"Processing page {page}/{self.page-1}")
             self.params["page"] = page
             html_content = self.get_pageContent()
             
             if not html_content:
                 self.logger.error(f"Failed to fetch page {page}, skipping")
-                return page_data
-
-            soup = BeautifulSoup(html_content, 'html.parser')
-            articles = soup.find_all('article', {'data-sentry-component': 'AdvertCard'})
-            
-            for article in articles:
-                try:
-                    entry = self._extract_property_data(article)
-                    if entry:
-                        page_data.append(entry)
-                except Exception as e:
-                    self.logger.error(f"Failed to process listing on page {page}: {str(e)}")
-                    continue
-            
-            return page_data
+                return []
+            return self._parse_listing_page(html_content, page)
 
         # Use ThreadPoolExecutor for parallel processing
         with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
@@ -317,7 +379,66 @@ class OtodomScraper:
 
         return self.totalitems
 
-    def _extract_property_data(self, article: BeautifulSoup) -> Optional[Dict[str, Union[str, int, float]]]:
+    def _parse_listing_page(self, html_content: str, page: int) -> List[Listing]:
+        '''
+        Extracts and normalises all listings of a single search result page.
+
+        Args:
+            html_content: HTML of the page
+            page: Page number, used in log messages
+
+        Returns:
+            list: Listings found on the page
+        '''
+        page_data = []
+        soup = BeautifulSoup(html_content, 'html.parser')
+        articles = soup.find_all('article', {'data-sentry-component': 'AdvertCard'})
+
+        for article in articles:
+            try:
+                entry = self._extract_property_data(article)
+                if entry:
+                    page_data.append(entry)
+            except Exception as e:
+                self.logger.error(f"Failed to process listing on page {page}: {str(e)}")
+                continue
+
+        for listing in normalize_listings(page_data):
+            self.logger.warning(f"Unparseable {', '.join(listing.invalid_fields)} for listing {listing.link}")
+        return page_data
+
+    def reparse_archive(self, fetch_date: Optional[str] = None) -> Union[int, None]:
+        '''
+        Rebuilds flats data from archived pages without any network access.
+        --------------------------------
+        Args:
+            fetch_date: Day of the archived scrape (Y-m-d), the newest one when not given.
+        Returns:
+            int: Total number of parsed items
+            None: If there is nothing to reparse
+        '''
+        pages = self.archive.listing_pages(self.city_name, fetch_date) if self.archive else []
+        if not pages:
+            self.logger.error(f"No archived listing pages found for city '{self.city_name}'")
+            return None
+
+        all_data = []
+        # Detail pages are read as they were on the day of the listing pages
+        self.archive_date = pages[0][2]
+        for page, url, archived_date in pages:
+            archived = self.archive.latest(url, until=archived_date)
+            if archived is None:
+                self.logger.error(f"Archived page {page} has no body, skipping")
+                continue
+            self.logger.info(f"Reparsing page {page} fetched on {archived_date}")
+            all_data.extend(self._parse_listing_page(archived[0], page))
+        if all_data:
+            self.__create_database()
+            self.__insert_data(all_data, scrape_date=pages[0][2])
+
+        return len(all_data)
+
+    def _extract_property_data(self, article: BeautifulSoup) -> Optional[Listing]:
         '''
         Extracts property data from a single article element.
         
@@ -325,7 +446,7 @@ class OtodomScraper:
             article: BeautifulSoup object representing a single property listing
             
         Returns:
-            dict: Property data if extraction successful
+            Listing: Property data if extraction successful
             None: If extraction fails
         '''
         try:
@@ -369,16 +490,16 @@ class OtodomScraper:
                 return None
 
             full_url = 'https://www.otodom.pl' + link['href']
-            return {
-                'total_price': self.__clean_numeric_data(price_text.text),
-                'title': title.text.strip(),
-                'address': address.text.strip(),
-                'link': full_url,
-                'rooms': rooms.text.strip(),
-                'surface': self.__clean_numeric_data(surface.text),
-                'price_per_meter': self.__clean_numeric_data(price_per_meter_text.text),
-                'rent_price': self.get_rent_price(full_url)
-            }
+            return Listing(
+                title=title.text.strip(),
+                address=address.text.strip(),
+                link=full_url,
+                rooms=rooms.text.strip(),
+                surface=surface.text,
+                price_per_meter=price_per_meter_text.text,
+                total_price=price_text.text,
+                rent_price=self.get_rent_price(full_url)
+            )
         except (AttributeError, KeyError, ValueError) as e:
             import traceback
             tb = traceback.format_exc()
@@ -407,66 +528,62 @@ class OtodomScraper:
             self.logger.error(f"Error parsing items counter: {str(e)}")
             return None
 
-    def get_total_flats(self) -> int:
+    def get_city_stats(self) -> Optional[Dict[str, Union[int, float, None]]]:
         '''
-        Function to get the total number of flats in DB for the current city.
+        Function to get the maintained summary of the current city from city_stats.
         --------------------------------
         Returns:
-            int: The total number of flats in the database for the current city.
+            dict: Number of flats, average total price, price per meter and surface, last scrape id.
+            None: If the city has no stats yet or the query failed.
         '''
         conn = None
         try:
-            conn = psycopg2.connect(
-                dbname="otodom_db",
-                user="scraper_user",
-                password="1234",
-                host="localhost"
-            )
+            conn = self.__get_connection()
             cursor = conn.cursor()
-
-            # Pobranie ID miasta
-            cursor.execute('SELECT id FROM cities WHERE name = %s', (self.city_name,))
-            city_row = cursor.fetchone()
-            if not city_row:
-                self.logger.warning(f"No city found with name '{self.city_name}' in database.")
-                cursor.close()
-                conn.close()
-                return 0
-            city_id = city_row[0]
-
-            # Zliczenie mieszkań dla danego miasta
-            cursor.execute('''
-                SELECT COUNT(*)
-                FROM flats f
-                JOIN scrapes s ON f.scrape_id = s.id
-                WHERE s.city_id = %s
-            ''', (city_id,))
-            total_flats = cursor.fetchone()[0]
+            stats = get_city_stats(cursor, self.city_name)
+            if stats is None:
+                self.logger.warning(f"No stats found for city '{self.city_name}' in database.")
+            return stats
         except psycopg2.Error as e:
-            self.logger.error(f"Database error when counting flats for city '{self.city_name}': {e}")
-            return 0
-        except Exception as e:
-            self.logger.exception(f"Unexpected error when counting flats for city '{self.city_name}': {e}")
-            return 0
+            self.logger.error(f"Database error when reading stats for city '{self.city_name}': {e}")
+            return None
         finally:
             if conn:
                 self.logger.info("Database connection closed.")
-                conn.close()
-        return total_flats
+                self.__release_connection(conn)
+
+    def get_total_flats(self) -> int:
+        '''
+        Function to get the total number of flats in DB for the current city.
+        --------------------------------
+        Returns:
+            int: The total number of flats in the database for the current city.
+        '''
+        stats = self.get_city_stats()
+        return stats['total_flats'] if stats else 0
     
-    def get_rent_price(self, link: str) -> Union[int, float]:
+    def get_rent_price(self, link: str) -> Optional[str]:
         '''
-        Function to get the rent price if exists.
+        Function to get the raw rent price text if exists.
+        The rent cache is only used without an archive: with one, the detail page is always
+        requested (cheaply, as a conditional request) so rent changes are seen and the page is archived.
         --------------------------------
         Args:
             link: The URL of the listing to fetch rent price from.
         Returns:
-            int: The rent price if found, otherwise 0.
+            str: The rent price text, e.g. '650 zł'. Parsed later by `normalize_listings`.
+            None: If the listing page could not be fetched.
         '''
+        if self.archive is None and link in self.rent_cache:
+            return self.rent_cache[link][1]
         html_content = self.get_pageContent(url=link)
-        soup = BeautifulSoup(html_content, 'html.parser') # type: ignore
+        if not html_content:
+            return None
+        soup = BeautifulSoup(html_content, 'html.parser')
         first_item = soup.find("div", {"data-sentry-element": "ItemGridContainer", "data-sentry-source-file": "AdDetailItem.tsx"})
         for i in range(4):
             first_item = first_item.find_next("div", {"data-sentry-element": "ItemGridContainer", "data-sentry-source-file": "AdDetailItem.tsx"})
-        value = self.__clean_numeric_data(first_item.text.split(":")[1])
-        return value if value is not None else 0
+        rent_text = first_item.text.split(":")[1]
+        if self.archive is None:
+            self.rent_cache[link] = (time.time(), rent_text)
+        return rent_text
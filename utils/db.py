@@ -0,0 +1,17 @@
+import psycopg2
+
+DB_CONFIG = {
+    "dbname": "otodom_db",
+    "user": "scraper_user",
+    "password": "1234",
+    "host": "localhost"
+}
+
+def connect():
+    '''
+    Open a new connection to the Otodom PostgreSQL database.
+    --------------------------------
+    Returns:
+        psycopg2 connection object.
+    '''
+    return psycopg2.connect(**DB_CONFIG)
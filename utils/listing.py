@@ -0,0 +1,33 @@
+from dataclasses import dataclass
+from typing import Tuple, Union
+
+# Numeric fields hold the raw page text until the batch is normalised
+Number = Union[int, float, str, None]
+
+@dataclass(slots=True)
+class Listing:
+    '''
+    Single scraped property listing.
+    Uses __slots__ instead of a per-object dict, which keeps large multi-city runs small in memory.
+    '''
+    title: str
+    address: str
+    link: str
+    rooms: str
+    surface: Number = None
+    price_per_meter: Number = None
+    total_price: Number = None
+    rent_price: Number = None
+    invalid_fields: Tuple[str, ...] = ()
+
+    def as_row(self) -> Tuple[str, str, str, str, Number, Number, Number, Number]:
+        '''
+        Return the listing as a tuple in the column order of the flats table.
+        Example: (title, address, link, rooms, surface, price_per_meter, total_price, rent_price)
+        '''
+        return (self.title, self.address, self.link, self.rooms,
+                self.surface, self.price_per_meter, self.total_price, self.rent_price)
+
+    def __reduce__(self):
+        # Pickle as a plain tuple of values for cheap transfer between processes
+        return (Listing, self.as_row() + (self.invalid_fields,))
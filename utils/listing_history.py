@@ -0,0 +1,225 @@
+import hashlib
+
+from psycopg2.extras import execute_values
+from typing import Dict, List, Tuple, Union
+from utils.city_stats import STAT_COLUMNS, add_to_delta, empty_delta
+from utils.listing import Listing
+from utils.normalize import NUMERIC_COLUMNS
+
+# Bumped whenever the hashed form changes, the next migration then rehashes stored flats once
+HASH_VERSION = 'v2'
+
+def create_history_schema(cursor) -> None:
+    '''
+    Add the content hash column to flats and create the flat_versions history table.
+    Stored hashes are recomputed only when schema_version holds another HASH_VERSION.
+    --------------------------------
+    Args:
+        cursor: Open psycopg2 cursor.
+    '''
+    # ALTER TABLE locks flats exclusively even when the column exists, so only run it when missing
+    cursor.execute('''
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'flats'
+    ''')
+    columns = {row[0] for row in cursor.fetchall()}
+    if 'content_hash' not in columns:
+        cursor.execute('ALTER TABLE flats ADD COLUMN content_hash TEXT')
+    if 'invalid_fields' not in columns:
+        # Fields that could not be parsed on the page, which is why they are NULL
+        cursor.execute('ALTER TABLE flats ADD COLUMN invalid_fields TEXT[]')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS flat_versions (
+            id SERIAL PRIMARY KEY,
+            flat_id INTEGER,
+            scrape_id INTEGER,
+            content_hash TEXT,
+            surface FLOAT,
+            price_per_meter FLOAT,
+            total_price INTEGER,
+            rent_price INTEGER,
+            FOREIGN KEY (flat_id) REFERENCES flats(id) ON DELETE CASCADE,
+            FOREIGN KEY (scrape_id) REFERENCES scrapes(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute("SELECT to_regclass('idx_flat_versions_flat_id') IS NULL")
+    if cursor.fetchone()[0]:
+        cursor.execute('CREATE INDEX idx_flat_versions_flat_id ON flat_versions(flat_id)')
+    # One-row table, the check keeps a regular scrape from scanning flats
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            hash_version TEXT
+        )
+    ''')
+    cursor.execute('SELECT hash_version FROM schema_version')
+    row = cursor.fetchone()
+    if row is None or row[0] != HASH_VERSION:
+        rehash_flats(cursor)
+        cursor.execute('''
+            INSERT INTO schema_version (hash_version) VALUES (%s)
+            ON CONFLICT (id) DO UPDATE SET hash_version = EXCLUDED.hash_version
+        ''', (HASH_VERSION,))
+
+def rehash_flats(cursor, batch_size: int = 10000) -> None:
+    '''
+    Recompute content hashes of flats stored without a hash or with an older hash version,
+    so that the next scrape does not see them as changed.
+    --------------------------------
+    Args:
+        cursor: Open psycopg2 cursor.
+        batch_size: Number of rows read and updated at once.
+    '''
+    reader = cursor.connection.cursor(name='rehash_flats')
+    reader.execute('''
+        SELECT id, title, address, rooms, surface, price_per_meter, total_price, rent_price
+        FROM flats
+        WHERE content_hash IS NULL OR content_hash NOT LIKE %s
+    ''', (HASH_VERSION + ':%',))
+    while True:
+        rows = reader.fetchmany(batch_size)
+        if not rows:
+            break
+        execute_values(cursor, '''
+            UPDATE flats AS f SET content_hash = v.content_hash
+            FROM (VALUES %s) AS v(id, content_hash)
+            WHERE f.id = v.id
+        ''', [(row[0], content_hash(Listing(row[1], row[2], '', *row[3:]))) for row in rows])
+    reader.close()
+
+def canonical_value(value) -> str:
+    '''
+    Text form of a field used for hashing. Numbers are formatted the same way
+    whether they are int or float, so a value read back from the database hashes
+    like the freshly scraped one.
+    Example: 54 -> '54.00', 54.0 -> '54.00', None -> ''
+    '''
+    if value is None:
+        return ''
+    if isinstance(value, (int, float)):
+        return f"{float(value):.2f}"
+    return str(value)
+
+def content_hash(flat: Listing) -> str:
+    '''
+    Hash the fields of a listing that can change between scrapes.
+    --------------------------------
+    Args:
+        flat: Scraped listing.
+    Returns:
+        str: Hash version and hex digest of the listing content, e.g. 'v2:3f1c...'.
+    '''
+    content = '\x1f'.join(canonical_value(value) for value in (
+        flat.title, flat.address, flat.rooms, flat.surface,
+        flat.price_per_meter, flat.total_price, flat.rent_price
+    ))
+    return HASH_VERSION + ':' + hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+def store_changes(cursor, city_id: int, scrape_id: int, data: List[Listing],
+                  update_current: bool = True) -> Tuple[int, int, Dict[int, Dict[str, Union[int, float]]]]:
+    '''
+    Compare listings with the stored content hashes and write only new and changed ones.
+    New listings are inserted into flats, changed listings are updated in place, and
+    both get a row in flat_versions with the current scrape id. Unchanged listings cost no writes.
+    Fields flagged as unparseable keep their stored value, so a failed parse or fetch
+    is not recorded as a change; fields still without a value are saved in flats.invalid_fields.
+    With update_current=False (a scrape older than the newest one) stored listings are left as they are:
+    only missing listings are inserted and differing ones get a flat_versions row for this scrape.
+    --------------------------------
+    Args:
+        cursor: Open psycopg2 cursor.
+        city_id: Id of the scraped city.
+        scrape_id: Id of the current scrape.
+        data: List of scraped listings.
+        update_current: Whether changed listings overwrite the current values in flats.
+    Returns:
+        tuple: Number of new and changed listings and the city_stats deltas they cause, per city id.
+            A changed listing first stored under another city's scrape is charged to that city.
+    '''
+    flats = {flat.link: flat for flat in data}
+
+    cursor.execute(f'''
+        SELECT f.link, f.id, f.content_hash, s.city_id, {', '.join('f.' + column for column in NUMERIC_COLUMNS)}
+        FROM flats f
+        LEFT JOIN scrapes s ON f.scrape_id = s.id
+        WHERE f.link = ANY(%s)
+    ''', (list(flats),))
+    stored = {row[0]: (row[1], row[2], dict(zip(NUMERIC_COLUMNS, row[4:])), row[3]) for row in cursor.fetchall()}
+    deltas = {city_id: empty_delta()}
+
+    new_rows = []
+    changed_rows = []
+    backdated = []
+    hashes = {}
+    for link, flat in flats.items():
+        if link in stored and flat.invalid_fields:
+            for field in flat.invalid_fields:
+                setattr(flat, field, stored[link][2][field])
+            flat.invalid_fields = tuple(field for field in flat.invalid_fields if getattr(flat, field) is None)
+        hashes[link] = content_hash(flat)
+        row = flat.as_row() + (hashes[link], list(flat.invalid_fields) or None)
+        if link not in stored:
+            new_rows.append((scrape_id,) + row)
+        elif stored[link][1] != hashes[link] and not update_current:
+            backdated.append((stored[link][0], link))
+        elif stored[link][1] != hashes[link]:
+            changed_rows.append((stored[link][0],) + row)
+
+    # Rows are written in a fixed order so concurrent scrapes of overlapping listings
+    # lock them in the same order instead of deadlocking
+    new_rows.sort(key=lambda row: row[3])
+    changed_rows.sort(key=lambda row: row[0])
+    if changed_rows:
+        # A concurrent scrape may have updated these rows since they were read above,
+        # so the values taken out of city_stats are read again under the row lock
+        cursor.execute(f'''
+            SELECT id, content_hash, {', '.join(STAT_COLUMNS)} FROM flats
+            WHERE id = ANY(%s) ORDER BY id FOR UPDATE
+        ''', ([row[0] for row in changed_rows],))
+        locked = {row[0]: (row[1], dict(zip(STAT_COLUMNS, row[2:]))) for row in cursor.fetchall()}
+        changed_rows = [row for row in changed_rows if row[0] in locked and locked[row[0]][0] != hashes[row[3]]]
+        for row in changed_rows:
+            delta = deltas.setdefault(stored[row[3]][3], empty_delta())
+            for column in STAT_COLUMNS:
+                add_to_delta(delta, column, locked[row[0]][1][column], sign=-1)
+                add_to_delta(delta, column, getattr(flats[row[3]], column))
+    versions = []
+    if new_rows:
+        inserted = execute_values(cursor, '''
+            INSERT INTO flats (scrape_id, title, address, link, rooms, surface, price_per_meter, total_price, rent_price,
+                               content_hash, invalid_fields)
+            VALUES %s
+            ON CONFLICT (link) DO NOTHING
+            RETURNING id, link
+        ''', new_rows, fetch=True)
+        versions.extend((flat_id, link) for flat_id, link in inserted)
+        deltas[city_id]['total_flats'] += len(inserted)
+        for _, link in inserted:
+            for column in STAT_COLUMNS:
+                add_to_delta(deltas[city_id], column, getattr(flats[link], column))
+    if changed_rows:
+        execute_values(cursor, '''
+            UPDATE flats AS f
+            SET title = v.title, address = v.address, rooms = v.rooms, surface = v.surface,
+                price_per_meter = v.price_per_meter, total_price = v.total_price,
+                rent_price = v.rent_price, content_hash = v.content_hash, invalid_fields = v.invalid_fields
+            FROM (VALUES %s) AS v(id, title, address, link, rooms, surface, price_per_meter, total_price, rent_price,
+                                  content_hash, invalid_fields)
+            WHERE f.id = v.id
+        ''', changed_rows, template='(%s::int, %s, %s, %s, %s, %s::float, %s::float, %s::int, %s::int, %s, %s::text[])')
+        versions.extend((row[0], row[3]) for row in changed_rows)
+    if backdated:
+        # A repeated reparse of the same day must not record the same version twice
+        cursor.execute('SELECT flat_id FROM flat_versions WHERE scrape_id = %s AND flat_id = ANY(%s)',
+                       (scrape_id, [flat_id for flat_id, _ in backdated]))
+        recorded = {row[0] for row in cursor.fetchall()}
+        versions.extend((flat_id, link) for flat_id, link in backdated if flat_id not in recorded)
+
+    if versions:
+        execute_values(cursor, '''
+            INSERT INTO flat_versions (flat_id, scrape_id, content_hash, surface, price_per_meter, total_price, rent_price)
+            VALUES %s
+        ''', [(flat_id, scrape_id, hashes[link]) + flats[link].as_row()[4:] for flat_id, link in versions])
+
+    new = deltas[city_id]['total_flats']
+    return new, len(versions) - new, deltas
@@ -0,0 +1,66 @@
+import re
+
+from typing import List, Sequence, Tuple
+from utils.listing import Listing, Number
+
+# First number in the text, with spaces as thousands separators and ',' or '.' as decimal mark
+NUMBER_PATTERN = re.compile(r'\d[\d \u00a0\u202f]*(?:[.,]\d+)?')
+NUMBER_CLEANUP = str.maketrans({' ': None, '\u00a0': None, '\u202f': None, ',': '.'})
+
+# Target type of every numeric column of a listing
+NUMERIC_COLUMNS = {
+    'surface': float,
+    'price_per_meter': float,
+    'total_price': int,
+    'rent_price': int,
+}
+
+def parse_column(values: Sequence[Number], to_type: type) -> Tuple[List[Number], List[int]]:
+    '''
+    Parse a whole column of raw numeric strings into one type.
+    --------------------------------
+    Args:
+        values: Raw strings, e.g. '599 000 zł', '12 345,50 zł/m²', '54,5 m²'.
+        to_type: int or float.
+    Example:
+        Input: ['23 000zł', 'Zapytaj o cenę'], int
+        Output: ([23000, None], [1])
+    Returns:
+        tuple: Parsed values and indices of values that could not be parsed.
+    '''
+    parsed = []
+    invalid = []
+    for idx, value in enumerate(values):
+        if isinstance(value, (int, float)):
+            parsed.append(to_type(round(value)) if to_type is int else to_type(value))
+            continue
+        match = NUMBER_PATTERN.search(value) if isinstance(value, str) else None
+        if match is None:
+            parsed.append(None)
+            invalid.append(idx)
+            continue
+        number = float(match.group().translate(NUMBER_CLEANUP))
+        parsed.append(round(number) if to_type is int else number)
+    return parsed, invalid
+
+def normalize_listings(listings: List[Listing]) -> List[Listing]:
+    '''
+    Convert raw numeric text of a batch of listings into typed values in place.
+    Values that can not be parsed are stored as None and the field name is
+    added to `invalid_fields` of the listing.
+    --------------------------------
+    Args:
+        listings: Listings with raw text in numeric fields.
+    Returns:
+        list: Listings with at least one unparseable field.
+    '''
+    flagged = {}
+    for field, to_type in NUMERIC_COLUMNS.items():
+        parsed, invalid = parse_column([getattr(listing, field) for listing in listings], to_type)
+        for listing, value in zip(listings, parsed):
+            setattr(listing, field, value)
+        for idx in invalid:
+            listing = listings[idx]
+            listing.invalid_fields += (field,)
+            flagged[id(listing)] = listing
+    return list(flagged.values())
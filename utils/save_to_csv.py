@@ -1,7 +1,20 @@
 import pandas as pd
 import sqlite3
 
-def save_to_csv():
+from utils.snapshot import AnalyticsSnapshot
+
+def save_to_csv(city=None):
+    if city:
+        snapshot = AnalyticsSnapshot(city)
+        snapshot.refresh()
+        df = snapshot.to_dataframe()
+        if df.empty:
+            print(f"No data found for {city}")
+            return
+        # District is derived for the plots, the export keeps the full address
+        df.drop(columns="district").to_csv(f"{snapshot.city_name}.csv", index=False)
+        print(f"Data saved to {snapshot.city_name}.csv")
+        return
     conn = sqlite3.connect('databases/otodom.db')
     cursor = conn.cursor()
     cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
@@ -0,0 +1,160 @@
+import concurrent.futures
+import json
+import logging
+import os
+import random
+import signal
+import threading
+import time
+
+import requests
+
+from psycopg2 import pool
+from requests.adapters import HTTPAdapter
+from typing import Callable, Dict, List, Tuple
+from utils.archive import ResponseArchive
+from utils.data_scrapper import OtodomScraper
+from utils.db import DB_CONFIG
+
+class ScrapeScheduler:
+    '''
+    Long-running daemon that scrapes a configured set of cities on per-city intervals.
+    The HTTP session, DB connection pool, geocode cache and rent cache stay warm between runs.
+
+    Example config (JSON):
+        {
+            "status_file": "status/daemon.json",
+            "rent_cache_ttl_hours": 0,
+            "archive": "archive/responses.db",
+            "cities": [
+                {"city": "Gdańsk", "interval_hours": 24, "jitter_minutes": 30, "minarea": 0, "maxarea": 1000}
+            ]
+        }
+    '''
+    def __init__(self, config_path: str, setup_logger: Callable[..., logging.Logger]):
+        with open(config_path, encoding="utf-8") as f:
+            config = json.load(f)
+        self.cities: List[Dict] = config["cities"]
+        self.status_file = config.get("status_file", os.path.join("status", "daemon.json"))
+        # Off by default: a cached rent is not re-fetched, so its changes are not recorded
+        self.rent_cache_ttl = config.get("rent_cache_ttl_hours", 0) * 3600
+        self.setup_logger = setup_logger
+        self.logger = setup_logger(name=__name__, city="Daemon")
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.cities), pool_maxsize=10 * len(self.cities))
+        self.session.mount("https://", adapter)
+        # The pool closes returned connections above minconn, so keep one per city open
+        self.db_pool = pool.ThreadedConnectionPool(len(self.cities), 2 * len(self.cities), **DB_CONFIG)
+        self.geocode_cache: Dict[str, Tuple[str, str, str]] = {}
+        self.rent_cache: Dict[str, Tuple[float, str]] = {}
+        self.archive = ResponseArchive(config["archive"]) if config.get("archive") else None
+
+        self.scrapers: Dict[str, OtodomScraper] = {}
+        self.running: Dict[str, concurrent.futures.Future] = {}
+        self.status: Dict[str, Dict] = {entry["city"]: {} for entry in self.cities}
+        self.status_lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    def __shared_logger(self, name: str = "app_logger", city: str = '') -> logging.Logger:
+        # Scrapers are created once per city, reuse the logger instead of stacking handlers
+        logger = logging.getLogger(name)
+        return logger if logger.handlers else self.setup_logger(name=name, city=city)
+
+    def __next_run(self, entry: Dict, now: float) -> float:
+        jitter = random.uniform(0, entry.get("jitter_minutes", 0) * 60)
+        return now + entry.get("interval_hours", 24) * 3600 + jitter
+
+    def __prune_rent_cache(self) -> None:
+        expired = time.time() - self.rent_cache_ttl
+        for link, (fetched_at, _) in list(self.rent_cache.items()):
+            if fetched_at < expired:
+                self.rent_cache.pop(link, None)
+
+    def __write_status(self) -> None:
+        with self.status_lock:
+            status = {"updated": time.strftime('%Y-%m-%d %H:%M:%S'), "cities": self.status}
+            os.makedirs(os.path.dirname(self.status_file) or ".", exist_ok=True)
+            tmp_path = self.status_file + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(status, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.status_file)
+
+    def __update_status(self, city: str, **values) -> None:
+        with self.status_lock:
+            self.status[city].update(values)
+        self.__write_status()
+
+    def __run_city(self, entry: Dict) -> None:
+        city = entry["city"]
+        started = time.time()
+        self.__update_status(city, state="running", last_start=time.strftime('%Y-%m-%d %H:%M:%S'))
+        try:
+            if city not in self.scrapers:
+                self.scrapers[city] = OtodomScraper(
+                    min_area=entry.get("minarea", 0),
+                    max_area=entry.get("maxarea", 1000),
+                    setup_logger=self.__shared_logger,
+                    city=city,
+                    session=self.session,
+                    db_pool=self.db_pool,
+                    geocode_cache=self.geocode_cache,
+                    rent_cache=self.rent_cache,
+                    archive=self.archive
+                )
+            scraper = self.scrapers[city]
+            items = scraper.parse_data()
+            self.__update_status(city,
+                                 state="ok" if items else "failed",
+                                 error=None,
+                                 last_items=items or 0,
+                                 total_flats=scraper.get_total_flats(),
+                                 last_duration_s=round(time.time() - started, 1),
+                                 last_end=time.strftime('%Y-%m-%d %H:%M:%S'))
+            self.logger.info(f"Scrape of {city} finished with {items} items in {time.time() - started:.0f}s")
+        except Exception as e:
+            self.logger.exception(f"Scrape of {city} failed: {e}")
+            self.__update_status(city,
+                                 state="failed",
+                                 error=str(e),
+                                 last_duration_s=round(time.time() - started, 1),
+                                 last_end=time.strftime('%Y-%m-%d %H:%M:%S'))
+
+    def stop(self, *_) -> None:
+        self.logger.info("Stopping daemon after running scrapes finish.")
+        self.stop_event.set()
+
+    def run(self) -> None:
+        '''
+        Run scheduled scrapes until stopped with SIGINT or SIGTERM.
+        '''
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        now = time.time()
+        next_runs = {entry["city"]: now + random.uniform(0, entry.get("jitter_minutes", 0) * 60) for entry in self.cities}
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.cities), thread_name_prefix="daemon")
+        self.logger.info(f"Daemon started for cities: {', '.join(next_runs)}")
+        try:
+            while not self.stop_event.is_set():
+                now = time.time()
+                for entry in self.cities:
+                    city = entry["city"]
+                    if next_runs[city] > now:
+                        continue
+                    next_runs[city] = self.__next_run(entry, now)
+                    # Overlap guard: a slow run is never started twice
+                    if city in self.running and not self.running[city].done():
+                        self.logger.warning(f"Previous scrape of {city} is still running, skipping this run.")
+                        self.__update_status(city, last_skipped=time.strftime('%Y-%m-%d %H:%M:%S'))
+                        continue
+                    self.__prune_rent_cache()
+                    self.__update_status(city, next_run=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(next_runs[city])))
+                    self.running[city] = executor.submit(self.__run_city, entry)
+                self.stop_event.wait(min(60, max(1, min(next_runs.values()) - time.time())))
+        finally:
+            executor.shutdown(wait=True)
+            self.db_pool.closeall()
+            self.session.close()
+            if self.archive:
+                self.archive.close()
+            self.logger.info("Daemon stopped.")
@@ -0,0 +1,171 @@
+import logging
+import os
+import re
+
+import pandas as pd
+import psycopg2
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+
+from typing import Optional, List, Tuple
+from unidecode import unidecode
+from utils.db import connect
+
+SNAPSHOT_SCHEMA = pa.schema([
+    ("scrape_id", pa.int32()),
+    ("scrape_date", pa.string()),
+    ("title", pa.string()),
+    ("address", pa.string()),
+    ("link", pa.string()),
+    ("rooms", pa.string()),
+    ("surface", pa.float64()),
+    ("price_per_meter", pa.float64()),
+    ("total_price", pa.int64()),
+    ("rent_price", pa.int64()),
+    ("district", pa.string()),
+])
+
+def normalize_city_name(city: str) -> str:
+    '''
+    Normalise a city name the same way the scraper names it in the database.
+    Example: 'Gdańsk' -> 'gdansk'
+    '''
+    return re.sub(r'\W+', '_', unidecode(city).lower())
+
+def normalize_address(address: Optional[str]) -> str:
+    '''
+    Reduce a full listing address to its district part.
+    Example:
+        Input: ul. Długa, Śródmieście, Gdańsk, pomorskie
+        Output: Śródmieście
+    '''
+    if not isinstance(address, str):
+        return ''
+    parts = [s.strip() for s in address.split(',')]
+    return parts[-3] if len(parts) > 3 else parts[0]
+
+class AnalyticsSnapshot:
+    '''
+    Local columnar copy of a city's flats stored as an uncompressed Feather (Arrow IPC) file.
+    The file is memory-mapped on read and only rows from scrapes newer than the
+    last seen `scrape_id` (kept in the file metadata) are fetched from the database on refresh.
+    '''
+    def __init__(self, city: str, directory: str = "snapshots", logger: Optional[logging.Logger] = None):
+        self.city_name = normalize_city_name(city)
+        self.path = os.path.join(directory, f"{self.city_name}.feather")
+        self.logger = logger or logging.getLogger(__name__)
+        os.makedirs(directory, exist_ok=True)
+
+    def __last_scrape_id(self, table: Optional[pa.Table]) -> int:
+        if table is None:
+            return 0
+        metadata = table.schema.metadata or {}
+        if b"last_scrape_id" in metadata:
+            return int(metadata[b"last_scrape_id"])
+        return pc.max(table["scrape_id"]).as_py() if table.num_rows else 0
+
+    def __fetch_new_rows(self, last_scrape_id: int) -> Tuple[int, List[Tuple]]:
+        conn = None
+        try:
+            conn = connect()
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT c.id, COALESCE(MAX(s.id), 0)
+                FROM cities c
+                LEFT JOIN scrapes s ON s.city_id = c.id
+                WHERE c.name = %s
+                GROUP BY c.id
+            ''', (self.city_name,))
+            row = cursor.fetchone()
+            # Nothing newer than the snapshot, skip the row query entirely
+            if row is None or row[1] <= last_scrape_id:
+                return last_scrape_id, []
+            city_id, latest_scrape_id = row
+            # New flats of the newer scrapes, plus flats that got a version in one of them.
+            # Both halves filter on an indexed scrape_id range.
+            cursor.execute('''
+                SELECT f.scrape_id, s.scrape_date, f.title, f.address, f.link, f.rooms,
+                       f.surface, f.price_per_meter, f.total_price, f.rent_price
+                FROM flats f
+                JOIN scrapes s ON f.scrape_id = s.id
+                WHERE s.city_id = %(city_id)s AND f.scrape_id > %(last)s AND f.scrape_id <= %(latest)s
+                UNION
+                SELECT f.scrape_id, s.scrape_date, f.title, f.address, f.link, f.rooms,
+                       f.surface, f.price_per_meter, f.total_price, f.rent_price
+                FROM flat_versions v
+                JOIN flats f ON v.flat_id = f.id
+                JOIN scrapes s ON f.scrape_id = s.id
+                WHERE s.city_id = %(city_id)s AND v.scrape_id > %(last)s AND v.scrape_id <= %(latest)s
+                ORDER BY 1
+            ''', {"city_id": city_id, "last": last_scrape_id, "latest": latest_scrape_id})
+            return latest_scrape_id, cursor.fetchall()
+        finally:
+            if conn:
+                conn.close()
+
+    def __rows_to_table(self, rows: List[Tuple]) -> pa.Table:
+        columns = list(zip(*rows))
+        columns.append([normalize_address(address) for address in columns[3]])
+        return pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, SNAPSHOT_SCHEMA)],
+            schema=SNAPSHOT_SCHEMA
+        )
+
+    def load_table(self) -> Optional[pa.Table]:
+        '''
+        Memory-map the snapshot file without copying it into memory.
+        --------------------------------
+        Returns:
+            pa.Table | None: Snapshot table or None when no snapshot exists yet.
+        '''
+        if not os.path.exists(self.path):
+            return None
+        table = feather.read_table(self.path, memory_map=True)
+        # Files written with an older schema are rebuilt from scratch on the next refresh
+        if not table.schema.equals(SNAPSHOT_SCHEMA, check_metadata=False):
+            self.logger.info(f"Snapshot '{self.path}' has an outdated schema and will be rebuilt.")
+            return None
+        return table
+
+    def refresh(self) -> int:
+        '''
+        Append rows from scrapes that are not yet in the snapshot and replace rows
+        of listings whose content changed since the last refresh.
+        --------------------------------
+        Returns:
+            int: Number of appended or replaced rows.
+        '''
+        table = self.load_table()
+        last_scrape_id = self.__last_scrape_id(table)
+        try:
+            latest_scrape_id, rows = self.__fetch_new_rows(last_scrape_id)
+        except psycopg2.Error as e:
+            self.logger.error(f"Database error when refreshing snapshot for '{self.city_name}': {e}")
+            return 0
+        if latest_scrape_id <= last_scrape_id:
+            self.logger.info(f"Snapshot for '{self.city_name}' is up to date (last scrape id {last_scrape_id}).")
+            return 0
+
+        new_table = self.__rows_to_table(rows) if rows else SNAPSHOT_SCHEMA.empty_table()
+        if table is not None:
+            # Drop outdated versions of listings that are about to be re-appended
+            kept = table.filter(pc.invert(pc.is_in(table["link"], value_set=new_table["link"].combine_chunks())))
+            new_table = pa.concat_tables([kept.replace_schema_metadata(None), new_table])
+        new_table = new_table.replace_schema_metadata({"last_scrape_id": str(latest_scrape_id)})
+        # Uncompressed so that readers can memory-map the columns directly
+        tmp_path = self.path + ".tmp"
+        feather.write_feather(new_table, tmp_path, compression="uncompressed")
+        os.replace(tmp_path, self.path)
+        self.logger.info(f"Appended {len(rows)} rows to snapshot '{self.path}' (last scrape id {latest_scrape_id}).")
+        return len(rows)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        '''
+        Return the snapshot as a DataFrame, reusing the memory-mapped buffers where possible.
+        '''
+        table = self.load_table()
+        if table is None:
+            table = SNAPSHOT_SCHEMA.empty_table()
+        # Nullable Int64 keeps prices integral when some of them are missing
+        return table.to_pandas(split_blocks=True, self_destruct=True, types_mapper={pa.int64(): pd.Int64Dtype()}.get)
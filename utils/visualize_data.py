@@ -4,9 +4,12 @@ import matplotlib.pyplot as plt
 import numpy as np
 import sqlite3
 
+from utils.snapshot import AnalyticsSnapshot
+
 class Visualization:
-    def __init__(self, dark_mode=False, min_area=50, max_area=100):
+    def __init__(self, dark_mode=False, min_area=50, max_area=100, city=None):
         self.dark_mode = dark_mode
+        self.city = city
         self.min_area = min_area
         self.max_area = max_area
         sns.set_theme(context="poster", style="darkgrid" if self.dark_mode else "whitegrid")
@@ -15,6 +18,13 @@ class Visualization:
         plt.rcParams['font.size'] = 12
 
     def __fetch_data(self) -> pd.DataFrame:
+        if self.city:
+            snapshot = AnalyticsSnapshot(self.city)
+            snapshot.refresh()
+            df = snapshot.to_dataframe()
+            df['address'] = df['district']
+            # The plots expect missing prices as NaN like the sqlite path gives them
+            return df.astype({'total_price': float, 'rent_price': float})
         conn = sqlite3.connect('databases/otodom.db')
         cursor = conn.cursor()
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")